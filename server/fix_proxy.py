@@ -5,95 +5,192 @@ Fixed Proxy Server - Correctly handles POST to /api/generate
 """
 import json
 import http.server
+import http.client
 import socketserver
-import urllib.request
+import threading
+import time
+from urllib.parse import urlparse
 import sys
 
+# Prefer orjson when it's installed (2-5x faster, returns bytes), but
+# fall back to the stdlib so the script still runs without extras
+try:
+    import orjson
+
+    def _dumps(obj):
+        return orjson.dumps(obj)
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj).encode()
+
+    _loads = json.loads
+
 PORT = 3000
 OLLAMA_URL = "http://localhost:11434"
+# Upper bound on request bodies we'll stream upstream
+MAX_BODY_BYTES = 10 * 1024 * 1024
+_OLLAMA = urlparse(OLLAMA_URL)
+
+# Keep-alive connection to Ollama, one per thread, so every request
+# doesn't open and tear down a fresh TCP connection
+_local = threading.local()
+
+def ollama_request(method, path, body=None, headers=None, timeout=None):
+    """Talk to Ollama over this thread's reusable connection"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = http.client.HTTPConnection(_OLLAMA.hostname, _OLLAMA.port)
+        _local.conn = conn
+    # Reset every call: a timeout left over from a previous request on
+    # this connection must not leak onto this one (None = no timeout)
+    conn.timeout = timeout
+    if conn.sock:
+        conn.sock.settimeout(timeout)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        return conn.getresponse()
+    except (http.client.HTTPException, ConnectionError, OSError):
+        # Keep-alive socket went stale - reconnect and retry once when safe
+        conn.close()
+        if body is not None and not isinstance(body, (bytes, bytearray, memoryview, str)):
+            # A generator body (streamed request) is already partly
+            # consumed - resending it would leave Ollama waiting for
+            # bytes that never come, so surface the failure instead
+            raise
+        conn.request(method, path, body=body, headers=headers or {})
+        return conn.getresponse()
+
+def body_chunks(fp, remaining, bufsize=65536):
+    """Yield the request body in bounded chunks so a multi-megabyte
+    prompt is piped upstream instead of sitting fully in memory"""
+    while remaining > 0:
+        chunk = fp.read(min(bufsize, remaining))
+        if not chunk:
+            break
+        yield chunk
+        remaining -= len(chunk)
+
+# Short TTL cache for /health so dashboard polling doesn't hit Ollama
+# once per poll; the lock turns concurrent misses into one probe
+HEALTH_TTL = 3.0
+_health_cache = {'ts': 0.0, 'body': None}
+_health_lock = threading.Lock()
+
+def check_health():
+    """Probe Ollama and build the health payload"""
+    try:
+        # Check Ollama
+        response = ollama_request('GET', '/api/tags', timeout=2)
+        models_data = _loads(response.read())
+        models = [m.get('name') for m in models_data.get('models', [])]
+
+        return {
+            "status": "healthy",
+            "ollama": "connected",
+            "models": models,
+            "proxy_url": f"http://localhost:{PORT}",
+            "note": "/api/generate requires POST method"
+        }
+    except Exception as e:
+        return {
+            "status": "degraded",
+            "ollama": "disconnected",
+            "error": str(e),
+            "tip": "Run 'ollama serve' in another terminal"
+        }
+
+def startup_probe():
+    """Check Ollama in the background and pre-warm the health cache"""
+    health = check_health()
+    with _health_lock:
+        _health_cache['body'] = _dumps(health)
+        _health_cache['ts'] = time.monotonic()
+
+    if health['ollama'] == 'connected':
+        print(f"✅ Ollama connected. Models: {len(health['models'])}")
+    else:
+        print(f"⚠️  Ollama not connected: {health.get('error')}")
+        print(f"   Run 'ollama serve' in another terminal")
+
+# Static root page, encoded once at import so GET / is a single write
+ROOT_HTML = b"""
+        <html>
+        <body>
+            <h1>Training Copilot Proxy</h1>
+            <p>Server is running!</p>
+            <p>Endpoints:</p>
+            <ul>
+                <li><strong>POST</strong> /api/generate - Generate AI responses</li>
+                <li><strong>GET</strong> /health - Check server status</li>
+            </ul>
+            <p>Remember: /api/generate requires POST method</p>
+        </body>
+        </html>
+        """
 
 class FixedProxyHandler(http.server.BaseHTTPRequestHandler):
-    
+
+    # TCP_NODELAY so small header writes and streamed chunks aren't held
+    # back by Nagle's algorithm
+    disable_nagle_algorithm = True
+
+    # HTTP/1.1 keep-alive; every response below sends Content-Length or
+    # chunked framing so the connection can be reused
+    protocol_version = "HTTP/1.1"
+
     def do_GET(self):
         """Handle GET requests"""
-        if self.path == '/health':
-            self.handle_health()
-        elif self.path == '/':
-            self.handle_root()
-        elif self.path == '/api/generate':
-            # Return 405 for GET to /api/generate
-            self.send_response(405, "Method Not Allowed")
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps({
-                "error": True,
-                "code": 405,
-                "message": "GET method not allowed for /api/generate. Use POST."
-            }).encode())
+        handler = self.GET_ROUTES.get(self.path)
+        if handler:
+            handler(self)
         else:
             self.send_error(404, f"Not found: {self.path}")
-    
+
     def do_POST(self):
         """Handle POST requests"""
-        if self.path == '/api/generate':
-            self.handle_generate()
+        handler = self.POST_ROUTES.get(self.path)
+        if handler:
+            handler(self)
         else:
             self.send_error(404, f"Not found: {self.path}")
-    
+
+    def reject_get_generate(self):
+        """Return 405 for GET to /api/generate"""
+        self.send_json_bytes(405, _dumps({
+            "error": True,
+            "code": 405,
+            "message": "GET method not allowed for /api/generate. Use POST."
+        }))
+
     def do_OPTIONS(self):
         """Handle CORS preflight"""
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Content-Length', '0')
         self.end_headers()
     
     def handle_root(self):
         """Serve root page"""
-        html = """
-        <html>
-        <body>
-            <h1>Training Copilot Proxy</h1>
-            <p>Server is running!</p>
-            <p>Endpoints:</p>
-            <ul>
-                <li><strong>POST</strong> /api/generate - Generate AI responses</li>
-                <li><strong>GET</strong> /health - Check server status</li>
-            </ul>
-            <p>Remember: /api/generate requires POST method</p>
-        </body>
-        </html>
-        """
         self.send_response(200)
         self.send_header('Content-Type', 'text/html')
         self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Content-Length', str(len(ROOT_HTML)))
         self.end_headers()
-        self.wfile.write(html.encode())
+        self.wfile.write(ROOT_HTML)
     
     def handle_health(self):
         """Health check endpoint"""
-        try:
-            # Check Ollama
-            req = urllib.request.Request(f"{OLLAMA_URL}/api/tags")
-            with urllib.request.urlopen(req, timeout=2) as response:
-                models_data = json.loads(response.read())
-                models = [m.get('name') for m in models_data.get('models', [])]
-                
-                self.send_json(200, {
-                    "status": "healthy",
-                    "ollama": "connected",
-                    "models": models,
-                    "proxy_url": f"http://localhost:{PORT}",
-                    "note": "/api/generate requires POST method"
-                })
-        except Exception as e:
-            self.send_json(200, {
-                "status": "degraded",
-                "ollama": "disconnected",
-                "error": str(e),
-                "tip": "Run 'ollama serve' in another terminal"
-            })
+        with _health_lock:
+            if (time.monotonic() - _health_cache['ts'] >= HEALTH_TTL
+                    or _health_cache['body'] is None):
+                _health_cache['body'] = _dumps(check_health())
+                _health_cache['ts'] = time.monotonic()
+            body = _health_cache['body']
+        self.send_json_bytes(200, body)
     
     def handle_generate(self):
         """Handle AI generation requests"""
@@ -103,59 +200,101 @@ class FixedProxyHandler(http.server.BaseHTTPRequestHandler):
             if content_length == 0:
                 self.send_error(400, "Empty request body")
                 return
-            
-            post_data = self.rfile.read(content_length)
-            
-            # Forward to Ollama with POST
-            req = urllib.request.Request(
-                f"{OLLAMA_URL}/api/generate",
-                data=post_data,
-                headers={'Content-Type': 'application/json'},
-                method='POST'
-            )
-            
-            with urllib.request.urlopen(req) as response:
-                ollama_response = response.read()
-                
-                # Return to client
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
-                self.wfile.write(ollama_response)
-                
-        except urllib.error.HTTPError as e:
-            if e.code == 405:
+            if content_length > MAX_BODY_BYTES:
+                self.send_error(413, "Request body too large")
+                return
+
+            # Forward to Ollama with POST, piping the body through in
+            # chunks rather than reading it all first
+            response = ollama_request('POST', '/api/generate',
+                                      body=body_chunks(self.rfile, content_length),
+                                      headers={'Content-Type': 'application/json',
+                                               'Content-Length': str(content_length)})
+
+            if response.status == 405:
+                response.read()
                 self.send_error(405, "Ollama: Method Not Allowed - Make sure you're sending POST, not GET")
-            else:
-                self.send_error(e.code, f"Ollama error: {e.reason}")
+                return
+            if response.status != 200:
+                response.read()
+                self.send_error(response.status, f"Ollama error: {response.reason}")
+                return
+
+            # Stream to client as chunks arrive instead of buffering the
+            # whole generation - first bytes reach the client immediately
+            self.relay_response(response)
+
         except Exception as e:
             self.send_error(500, f"Proxy error: {str(e)}")
     
     def send_json(self, code, data):
         """Send JSON response"""
+        self.send_json_bytes(code, _dumps(data))
+
+    def send_json_bytes(self, code, body):
+        """Send an already-encoded JSON response"""
         self.send_response(code)
         self.send_header('Content-Type', 'application/json')
         self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def relay_response(self, response):
+        """Relay an upstream response with keep-alive-safe framing:
+        forward Content-Length if Ollama sent one, else chunk-encode"""
+        self.send_response(200)
+        self.send_header('Content-Type', response.headers.get('Content-Type', 'application/json'))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        length = response.headers.get('Content-Length')
+        chunked = length is None
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', length)
         self.end_headers()
-        self.wfile.write(json.dumps(data).encode())
+
+        while True:
+            chunk = response.read(8192)
+            if not chunk:
+                break
+            if chunked:
+                self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+            else:
+                self.wfile.write(chunk)
+            self.wfile.flush()
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
     
     def send_error(self, code, message):
         """Send error response"""
-        self.send_response(code)
-        self.send_header('Content-Type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(json.dumps({
+        self.send_json_bytes(code, _dumps({
             "error": True,
             "code": code,
             "message": message,
             "fix": "Make sure you're using POST method for /api/generate"
-        }).encode())
+        }))
     
     def log_message(self, format, *args):
         print(f"[{self.address_string()}] {format % args}")
 
+    # O(1) route dispatch; built after the methods so the names resolve
+    GET_ROUTES = {
+        '/health': handle_health,
+        '/': handle_root,
+        '/api/generate': reject_get_generate,
+    }
+    POST_ROUTES = {
+        '/api/generate': handle_generate,
+    }
+
+class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Handle each request in its own thread so a long Ollama generation
+    doesn't block health checks and other clients"""
+    daemon_threads = True
+    allow_reuse_address = True
+
 def main():
     print(f"""
     🚀 Training Copilot Fixed Proxy
@@ -179,20 +318,14 @@ def main():
     """)
     
     try:
-        server = socketserver.TCPServer(('', PORT), FixedProxyHandler)
+        server = ThreadedTCPServer(('', PORT), FixedProxyHandler)
         print(f"✅ Server running at http://localhost:{PORT}")
         print(f"📞 Testing Ollama connection...")
-        
-        # Test Ollama
-        try:
-            req = urllib.request.Request(f"{OLLAMA_URL}/api/tags")
-            with urllib.request.urlopen(req, timeout=5) as response:
-                models = json.loads(response.read()).get('models', [])
-                print(f"✅ Ollama connected. Models: {len(models)}")
-        except Exception as e:
-            print(f"⚠️  Ollama not connected: {e}")
-            print(f"   Run 'ollama serve' in another terminal")
-        
+
+        # Probe Ollama in the background so the server is accepting
+        # requests right away instead of blocking on the check
+        threading.Thread(target=startup_probe, daemon=True).start()
+
         print(f"\n🎯 Ready for POST requests to /api/generate")
         server.serve_forever()
         
@@ -4,20 +4,86 @@ Ollama Proxy Server
 Solves CORS issues for bookmarklet
 """
 import asyncio
+import hashlib
 import json
 import logging
-from aiohttp import web, ClientSession
+import os
+import socket
+import time
+from aiohttp import web, ClientSession, ClientTimeout, TCPConnector
+from collections import OrderedDict
 from datetime import datetime
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Use orjson when available - faster encode/decode and it produces bytes,
+# so responses skip the extra str -> bytes pass
+try:
+    import orjson
+
+    def _dumps(obj):
+        return orjson.dumps(obj)
+
+    def _dumps_sorted(obj):
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj).encode()
+
+    def _dumps_sorted(obj):
+        return json.dumps(obj, sort_keys=True).encode()
+
+    _loads = json.loads
+
+def json_response(data, status=200):
+    """web.json_response, but through the fast encoder"""
+    return web.Response(body=_dumps(data), status=status,
+                        content_type="application/json")
+
 # Configuration
 OLLAMA_HOST = "http://localhost:11434"
 ALLOWED_ORIGINS = ["*"]  # In production, specify your domains
 PORT = 3000
 
+# WORKERS=N forks N processes that each bind the port with SO_REUSEPORT;
+# the kernel load-balances accept() across them, so CPU work (JSON,
+# CORS, HTTP parsing) isn't serialized behind a single GIL
+WORKERS = int(os.environ.get("WORKERS", "1"))
+
+# /health and /api/models get polled constantly; keep the encoded reply
+# around for a short TTL so a poll burst costs one Ollama round-trip.
+# The lock coalesces concurrent cache misses into a single upstream call.
+CACHE_TTL = 3.0
+_response_cache = {}  # endpoint -> (monotonic ts, status, body bytes, etag)
+_cache_lock = asyncio.Lock()
+
+def _cache_get(key):
+    entry = _response_cache.get(key)
+    if entry and time.monotonic() - entry[0] < CACHE_TTL:
+        return entry
+    return None
+
+def _cache_put(key, status, body, etag=None):
+    entry = (time.monotonic(), status, body, etag)
+    _response_cache[key] = entry
+    return entry
+
+# Response cache for /api/generate: a repeat of the same
+# {model, prompt, options} tuple hits RAM instead of a multi-second
+# inference. Only the buffered (stream:false) path is cached; clients
+# can bypass it with a ?no-cache query parameter.
+GEN_CACHE_TTL = 600.0
+GEN_CACHE_MAX = 256
+_gen_cache = OrderedDict()  # sha256 of payload -> (monotonic ts, body)
+_gen_cache_lock = asyncio.Lock()
+
+def _gen_cache_key(payload):
+    return hashlib.sha256(_dumps_sorted(payload)).hexdigest()
+
 async def handle_options(request):
     """Handle CORS preflight requests"""
     headers = {
@@ -32,117 +98,210 @@ async def generate_completion(request):
     """Proxy requests to Ollama"""
     try:
         # Get request data
-        data = await request.json()
+        data = await request.json(loads=_loads)
         model = data.get("model", "llama2")
         prompt = data.get("prompt", "")
         max_tokens = data.get("max_tokens", 500)
-        
+        stream = bool(data.get("stream", True))
+
         logger.info(f"Generating completion with model: {model}")
-        
-        # Call Ollama
-        async with ClientSession() as session:
-            ollama_url = f"{OLLAMA_HOST}/api/generate"
-            
-            ollama_payload = {
-                "model": model,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "num_predict": max_tokens,
-                    "temperature": 0.3,
-                    "top_p": 0.9,
-                }
+
+        # Call Ollama over the shared session
+        session = request.app['http']
+
+        ollama_payload = {
+            "model": model,
+            "prompt": prompt,
+            "stream": stream,
+            "options": {
+                "num_predict": max_tokens,
+                "temperature": 0.3,
+                "top_p": 0.9,
             }
-            
-            async with session.post(ollama_url, json=ollama_payload) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    logger.error(f"Ollama error: {error_text}")
-                    return web.json_response(
-                        {"error": f"Ollama returned {response.status}"},
-                        status=500
-                    )
-                
-                result = await response.json()
-                
-                # Log the request for analysis
-                await log_interaction({
+        }
+
+        cache_key = None
+        if not stream and 'no-cache' not in request.query:
+            cache_key = _gen_cache_key(ollama_payload)
+            async with _gen_cache_lock:
+                entry = _gen_cache.get(cache_key)
+                if entry and time.monotonic() - entry[0] < GEN_CACHE_TTL:
+                    _gen_cache.move_to_end(cache_key)
+                    return web.Response(body=entry[1],
+                                        content_type="application/json")
+
+        async with session.post("/api/generate", json=ollama_payload) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                logger.error(f"Ollama error: {error_text}")
+                return json_response(
+                    {"error": f"Ollama returned {response.status}"},
+                    status=500
+                )
+
+            if stream:
+                # Forward NDJSON chunks as Ollama produces them so the
+                # client sees the first token right away instead of waiting
+                # for the whole generation
+                resp = web.StreamResponse()
+                resp.headers['Content-Type'] = 'application/x-ndjson'
+                resp.headers['Access-Control-Allow-Origin'] = '*'
+                await resp.prepare(request)
+
+                sent = 0
+                async for chunk in response.content.iter_any():
+                    await resp.write(chunk)
+                    sent += len(chunk)
+                await resp.write_eof()
+
+                request.app['log_queue'].put_nowait({
                     "timestamp": datetime.now().isoformat(),
                     "model": model,
                     "prompt_length": len(prompt),
-                    "response_length": len(result.get("response", "")),
+                    "response_length": sent,
                     "prompt_preview": prompt[:100]
                 })
-                
-                return web.json_response({
-                    "success": True,
-                    "response": result.get("response", ""),
-                    "model": model,
-                    "tokens": result.get("eval_count", 0)
-                })
-                
-    except json.JSONDecodeError as e:
+                return resp
+
+            result = await response.json()
+
+            # Log the request for analysis
+            request.app['log_queue'].put_nowait({
+                "timestamp": datetime.now().isoformat(),
+                "model": model,
+                "prompt_length": len(prompt),
+                "response_length": len(result.get("response", "")),
+                "prompt_preview": prompt[:100]
+            })
+
+            body = _dumps({
+                "success": True,
+                "response": result.get("response", ""),
+                "model": model,
+                "tokens": result.get("eval_count", 0)
+            })
+
+            if cache_key is not None:
+                async with _gen_cache_lock:
+                    _gen_cache[cache_key] = (time.monotonic(), body)
+                    _gen_cache.move_to_end(cache_key)
+                    while len(_gen_cache) > GEN_CACHE_MAX:
+                        _gen_cache.popitem(last=False)
+
+            return web.Response(body=body, content_type="application/json")
+
+    except ValueError as e:
         logger.error(f"JSON decode error: {e}")
-        return web.json_response(
+        return json_response(
             {"error": "Invalid JSON", "details": str(e)},
             status=400
         )
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
-        return web.json_response(
+        return json_response(
             {"error": "Internal server error", "details": str(e)},
             status=500
         )
 
 async def list_models(request):
     """List available Ollama models"""
+    entry = _cache_get('models')
+    if entry is None:
+        async with _cache_lock:
+            entry = _cache_get('models')
+            if entry is None:
+                status, data = await _fetch_models(request.app['http'])
+                body = _dumps(data)
+                # ETag lets pollers skip the body entirely when the model
+                # list hasn't changed; cached so it's hashed once per TTL
+                etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+                entry = _cache_put('models', status, body, etag)
+    _, status, body, etag = entry
+
+    if request.headers.get('If-None-Match') == etag:
+        return web.Response(status=304, headers={'ETag': etag})
+    return web.Response(body=body, status=status,
+                        content_type="application/json",
+                        headers={'ETag': etag})
+
+async def _fetch_models(session):
+    """Ask Ollama for its model list"""
     try:
-        async with ClientSession() as session:
-            async with session.get(f"{OLLAMA_HOST}/api/tags") as response:
-                if response.status != 200:
-                    return web.json_response(
-                        {"error": "Cannot connect to Ollama"},
-                        status=503
-                    )
-                models = await response.json()
-                
-                return web.json_response({
-                    "success": True,
-                    "models": [m["name"] for m in models.get("models", [])]
-                })
+        async with session.get("/api/tags") as response:
+            if response.status != 200:
+                return 503, {"error": "Cannot connect to Ollama"}
+            models = await response.json()
+
+            return 200, {
+                "success": True,
+                "models": [m["name"] for m in models.get("models", [])]
+            }
     except Exception as e:
-        return web.json_response(
-            {"error": str(e)},
-            status=500
-        )
+        return 500, {"error": str(e)}
 
 async def health_check(request):
     """Health check endpoint"""
+    entry = _cache_get('health')
+    if entry is None:
+        async with _cache_lock:
+            entry = _cache_get('health')
+            if entry is None:
+                status, data = await _fetch_health(request.app['http'])
+                entry = _cache_put('health', status, _dumps(data))
+    _, status, body, _etag = entry
+    return web.Response(body=body, status=status,
+                        content_type="application/json")
+
+async def _fetch_health(session):
+    """Probe Ollama and build the health payload"""
     try:
-        async with ClientSession() as session:
-            async with session.get(f"{OLLAMA_HOST}/api/tags", timeout=2) as response:
-                ollama_ok = response.status == 200
-                
-                return web.json_response({
-                    "status": "healthy" if ollama_ok else "degraded",
-                    "ollama": "connected" if ollama_ok else "disconnected",
-                    "timestamp": datetime.now().isoformat(),
-                    "server": "training-copilot-proxy"
-                })
+        async with session.get("/api/tags", timeout=ClientTimeout(total=2)) as response:
+            ollama_ok = response.status == 200
+
+            return 200, {
+                "status": "healthy" if ollama_ok else "degraded",
+                "ollama": "connected" if ollama_ok else "disconnected",
+                "timestamp": datetime.now().isoformat(),
+                "server": "training-copilot-proxy"
+            }
     except:
-        return web.json_response({
+        return 503, {
             "status": "unhealthy",
             "ollama": "disconnected",
             "timestamp": datetime.now().isoformat()
-        }, status=503)
+        }
+
+async def start_log_writer(app):
+    """Queue plus one writer task, so handlers never block on log I/O"""
+    app['log_queue'] = asyncio.Queue()
+    app['log_task'] = asyncio.create_task(_drain_log_queue(app['log_queue']))
 
-async def log_interaction(data):
-    """Log interactions to file"""
+async def stop_log_writer(app):
+    """Stop the background log writer on shutdown"""
+    app['log_task'].cancel()
     try:
-        with open("data/llm_interactions.log", "a") as f:
-            f.write(json.dumps(data) + "\n")
-    except:
-        pass  # Don't fail if logging fails
+        await app['log_task']
+    except asyncio.CancelledError:
+        pass
+
+async def _drain_log_queue(queue):
+    """Write queued interaction records in batches with one open file"""
+    try:
+        f = open("data/llm_interactions.log", "ab")
+    except OSError:
+        return  # Don't fail if logging fails
+    with f:
+        while True:
+            # Block for the first record, then sweep up whatever else is
+            # already waiting so a burst becomes a single write+flush
+            records = [await queue.get()]
+            while len(records) < 128:
+                try:
+                    records.append(queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            f.write(b"".join(_dumps(r) + b"\n" for r in records))
+            f.flush()
 
 def setup_cors(app):
     """Setup CORS middleware"""
@@ -160,12 +319,47 @@ def setup_cors(app):
     
     app.middlewares.append(cors_middleware)
 
+async def create_http_client(app):
+    """Create one long-lived Ollama client shared by all handlers"""
+    app['http'] = ClientSession(
+        base_url=OLLAMA_HOST,
+        timeout=ClientTimeout(total=300),
+        connector=TCPConnector(limit=64),
+    )
+
+async def close_http_client(app):
+    """Close the shared Ollama client on shutdown"""
+    await app['http'].close()
+
+async def warm_http_client(app):
+    """Pre-open a few connections to Ollama so the first user request
+    doesn't pay TCP connection setup on its critical path"""
+    async def probe():
+        try:
+            async with app['http'].get(
+                    "/api/tags", timeout=ClientTimeout(total=2)) as resp:
+                await resp.read()
+        except Exception:
+            # Ollama may not be up yet; the pool warms on first use instead
+            pass
+
+    await asyncio.gather(*[probe() for _ in range(4)])
+
 async def init_app():
     """Initialize the application"""
     app = web.Application()
-    
+
     # Setup CORS
     setup_cors(app)
+
+    # One Ollama connection pool for the whole app, kept warm across requests
+    app.on_startup.append(create_http_client)
+    app.on_startup.append(warm_http_client)
+    app.on_cleanup.append(close_http_client)
+
+    # Interaction logging happens off the request path
+    app.on_startup.append(start_log_writer)
+    app.on_cleanup.append(stop_log_writer)
     
     # Routes
     app.router.add_post("/api/generate", generate_completion)
@@ -179,6 +373,14 @@ async def init_app():
     return app
 
 if __name__ == "__main__":
+    # uvloop's libuv-based event loop cuts per-callback overhead and
+    # syscall count under keep-alive load; drop-in and optional
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+
     print(f"""
     🚀 Training Copilot Proxy Server
     =================================
@@ -188,12 +390,27 @@ if __name__ == "__main__":
       POST /api/generate  - Generate completions
       GET  /api/models    - List available models
       GET  /health        - Health check
-      
+
     Requirements:
       1. Ollama must be running at http://localhost:11434
       2. A model must be downloaded (e.g., 'ollama pull llama2')
-      
+
+    Scaling:
+      Set WORKERS=N to fork N worker processes (SO_REUSEPORT).
+
     Press Ctrl+C to stop the server.
     """)
-    
-    web.run_app(init_app(), port=PORT, access_log=None)
+
+    if WORKERS > 1 and hasattr(socket, 'SO_REUSEPORT') and hasattr(os, 'fork'):
+        for _ in range(WORKERS - 1):
+            if os.fork() == 0:
+                break
+        # Each worker binds its own SO_REUSEPORT socket so the kernel
+        # spreads incoming connections across the processes
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(('', PORT))
+        web.run_app(init_app(), sock=sock, access_log=None)
+    else:
+        web.run_app(init_app(), port=PORT, access_log=None)
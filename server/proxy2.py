@@ -4,18 +4,72 @@ Simple HTTP server that serves files AND acts as Ollama proxy
 NO CORS issues - everything runs on same origin!
 """
 import json
+import logging
 import http.server
+import http.client
 import socketserver
-import urllib.request
+import threading
 from urllib.parse import urlparse
 import os
 
+logger = logging.getLogger(__name__)
+
 PORT = 8000
 OLLAMA_URL = "http://localhost:11434"
+# Cap proxied bodies; image-bearing prompts are large but bounded
+MAX_BODY_BYTES = 10 * 1024 * 1024
+_OLLAMA = urlparse(OLLAMA_URL)
+
+def body_chunks(fp, remaining, bufsize=65536):
+    """Yield the request body in bounded chunks - keeps big prompts
+    (e.g. multimodal image payloads) from being buffered whole"""
+    while remaining > 0:
+        chunk = fp.read(min(bufsize, remaining))
+        if not chunk:
+            break
+        yield chunk
+        remaining -= len(chunk)
+
+# Per-thread keep-alive connection to Ollama - reusing the socket avoids
+# a new TCP handshake for every proxied request
+_local = threading.local()
+
+def ollama_request(method, path, body=None, headers=None, timeout=None):
+    """Send a request over this thread's keep-alive Ollama connection"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = http.client.HTTPConnection(_OLLAMA.hostname, _OLLAMA.port)
+        _local.conn = conn
+    # Reset every call: a timeout left over from a previous request on
+    # this connection must not leak onto this one (None = no timeout)
+    conn.timeout = timeout
+    if conn.sock:
+        conn.sock.settimeout(timeout)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        return conn.getresponse()
+    except (http.client.HTTPException, ConnectionError, OSError):
+        # Stale connection - reopen and retry once when safe
+        conn.close()
+        if body is not None and not isinstance(body, (bytes, bytearray, memoryview, str)):
+            # A generator body (streamed request) is already partly
+            # consumed - resending it would leave Ollama waiting for
+            # bytes that never come, so surface the failure instead
+            raise
+        conn.request(method, path, body=body, headers=headers or {})
+        return conn.getresponse()
 
 class TrainingCopilotHandler(http.server.SimpleHTTPRequestHandler):
     """Handler that serves static files AND proxies Ollama requests"""
-    
+
+    # TCP_NODELAY keeps Nagle's algorithm from delaying the many small
+    # writes this handler does (headers, then body)
+    disable_nagle_algorithm = True
+
+    # Keep-alive so browsers reuse the connection across asset and API
+    # requests; responses therefore always carry Content-Length
+    protocol_version = "HTTP/1.1"
+
     def do_GET(self):
         """Serve files for GET requests"""
         # Serve static files normally
@@ -34,42 +88,78 @@ class TrainingCopilotHandler(http.server.SimpleHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'POST, GET, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Content-Length', '0')
         self.end_headers()
     
+    def copyfile(self, source, outputfile):
+        """Send static files with os.sendfile - the kernel copies straight
+        from page cache to the socket, skipping the userspace round-trip"""
+        try:
+            in_fd = source.fileno()
+        except (AttributeError, OSError):
+            # Not a real file (e.g. generated directory listing)
+            return super().copyfile(source, outputfile)
+
+        if not hasattr(os, 'sendfile'):
+            return super().copyfile(source, outputfile)
+
+        # Headers are still sitting in the write buffer; flush them out
+        # before handing the raw socket fd to the kernel
+        outputfile.flush()
+        out_fd = outputfile.fileno()
+        offset = 0
+        size = os.fstat(in_fd).st_size
+        try:
+            while offset < size:
+                sent = os.sendfile(out_fd, in_fd, offset, size - offset)
+                if sent == 0:
+                    break
+                offset += sent
+        except OSError:
+            if offset == 0:
+                return super().copyfile(source, outputfile)
+            raise
+
+    def log_message(self, format, *args):
+        """Access log entries are debug-only so they're free by default"""
+        logger.debug(format, *args)
+
     def handle_ollama_request(self):
         """Forward request to Ollama"""
         try:
             # Read request body
             content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            
-            print(f"[Ollama Proxy] Forwarding request: {len(post_data)} bytes")
-            
-            # Forward to Ollama
-            req = urllib.request.Request(
-                f"{OLLAMA_URL}/api/generate",
-                data=post_data,
-                headers={'Content-Type': 'application/json'},
-                method='POST'
-            )
-            
-            with urllib.request.urlopen(req) as response:
-                ollama_response = response.read()
-                
-                # Send response back
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
-                self.wfile.write(ollama_response)
-                
-                print(f"[Ollama Proxy] Response: {len(ollama_response)} bytes")
-                
+            if content_length > MAX_BODY_BYTES:
+                self.send_error(413, "Request body too large")
+                return
+
+            logger.debug("[Ollama Proxy] Forwarding request: %s bytes", content_length)
+
+            # Forward to Ollama, streaming the body through in chunks
+            response = ollama_request('POST', '/api/generate',
+                                      body=body_chunks(self.rfile, content_length),
+                                      headers={'Content-Type': 'application/json',
+                                               'Content-Length': str(content_length)})
+            ollama_response = response.read()
+
+            # Send response back
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header('Content-Length', str(len(ollama_response)))
+            self.end_headers()
+            self.wfile.write(ollama_response)
+
+            logger.debug("[Ollama Proxy] Response: %s bytes", len(ollama_response))
+
         except Exception as e:
-            print(f"[Ollama Proxy] Error: {e}")
+            logger.error("[Ollama Proxy] Error: %s", e)
             self.send_error(500, f"Ollama proxy error: {str(e)}")
 
 def main():
+    # Per-request traces are logger.debug; export LOG_LEVEL=DEBUG to see them
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'WARNING'))
+
     print(f"""
     🌐 TRAINING COPILOT - ALL IN ONE SERVER
     ========================================
@@ -3,18 +3,71 @@
 Training Copilot ALL-IN-ONE Server
 Combines proxy server, Ollama check, and monitoring
 """
+import gzip
+import hashlib
+import mmap
 import json
 import http.server
-import socketserver
-import urllib.request
+import http.client
+from urllib.parse import urlparse
+from collections import OrderedDict
 from datetime import datetime
+import concurrent.futures
+import re
+import socket
 import threading
 import time
 import webbrowser
 import os
 
+# orjson is a few times faster on the small JSON bodies this proxy
+# shuffles and returns bytes directly, but stays optional - the script
+# must still run on a bare Python install
+try:
+    import orjson
+
+    def _dumps(obj):
+        return orjson.dumps(obj)
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+    _loads = json.loads
+
 PORT = 3000
 OLLAMA_URL = "http://localhost:11434"
+# Worker processes sharing the port via SO_REUSEPORT; threads alone
+# stay capped by the GIL on JSON and HTTP parsing
+WORKERS = int(os.environ.get('TC_WORKERS', '1'))
+_OLLAMA = urlparse(OLLAMA_URL)
+
+# One keep-alive connection to Ollama per thread - reused across
+# requests instead of paying a fresh TCP handshake on every call
+_local = threading.local()
+
+def ollama_request(method, path, body=None, headers=None, timeout=None):
+    """Send a request over this thread's keep-alive Ollama connection"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = http.client.HTTPConnection(_OLLAMA.hostname, _OLLAMA.port)
+        _local.conn = conn
+    # Reset every call: a timeout left over from a previous request on
+    # this connection must not leak onto this one (None = no timeout)
+    conn.timeout = timeout
+    if conn.sock:
+        conn.sock.settimeout(timeout)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        return conn.getresponse()
+    except (http.client.HTTPException, ConnectionError, OSError):
+        # Keep-alive socket went stale (e.g. Ollama restarted or idled
+        # out) - reconnect and retry once
+        conn.close()
+        conn.request(method, path, body=body, headers=headers or {})
+        return conn.getresponse()
+
 BOOKMARKLET_CODE = """
 javascript:(function(){
   // Ultra-simple bookmarklet for testing
@@ -33,239 +86,519 @@ javascript:(function(){
 })();
 """
 
-class TrainingCopilotHandler(http.server.SimpleHTTPRequestHandler):
+# Browsers cap bookmarklet URL length, so minify at import. Comment
+# lines must go first: once the newlines collapse, a // comment would
+# swallow the rest of the one-line script.
+BOOKMARKLET_CODE = re.sub(r'^\s*//.*$', '', BOOKMARKLET_CODE, flags=re.MULTILINE)
+BOOKMARKLET_CODE = re.sub(r'\s+', ' ', BOOKMARKLET_CODE).strip()
+_BOOKMARKLET_BYTES = BOOKMARKLET_CODE.encode('utf-8')
+
+# The dashboard page lives in dashboard.html next to this script,
+# with {{PORT}}/{{BOOKMARKLET}} filled in once at import and
+# {{STATUS}}/{{TIME}} left as the per-request split points - each
+# GET / just joins head + status + mid + time + tail
+_DASHBOARD_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'dashboard.html')
+with open(_DASHBOARD_PATH, 'rb') as _f:
+    with mmap.mmap(_f.fileno(), 0, access=mmap.ACCESS_READ) as _page:
+        _HOMEPAGE_TEMPLATE = _page[:].decode('utf-8')
+_HOMEPAGE_TEMPLATE = _HOMEPAGE_TEMPLATE.replace('{{PORT}}', str(PORT))
+_HOMEPAGE_TEMPLATE = _HOMEPAGE_TEMPLATE.replace('{{BOOKMARKLET}}',
+                                                BOOKMARKLET_CODE)
+_HOMEPAGE_HEAD, _rest = _HOMEPAGE_TEMPLATE.split('{{STATUS}}')
+_HOMEPAGE_MID, _HOMEPAGE_TAIL = _rest.split('{{TIME}}')
+_HOMEPAGE_HEAD = _HOMEPAGE_HEAD.encode('utf-8')
+_HOMEPAGE_MID = _HOMEPAGE_MID.encode('utf-8')
+_HOMEPAGE_TAIL = _HOMEPAGE_TAIL.encode('utf-8')
+
+# A dashboard reload burst shouldn't fan out to Ollama - the probe
+# result is cached for a second
+STATUS_TTL = 1.0
+_status_cache = {'ts': 0.0, 'result': (False, 0)}
+_status_lock = threading.Lock()
+
+def _probe_ollama():
+    """Check whether Ollama is up, cached for STATUS_TTL seconds.
+
+    Returns (connected, model_count); callers format their own
+    presentation from it."""
+    with _status_lock:
+        if time.monotonic() - _status_cache['ts'] < STATUS_TTL:
+            return _status_cache['result']
+    try:
+        response = ollama_request('GET', '/api/tags', timeout=2)
+        data = _loads(response.read())
+        result = (True, len(data.get("models", [])))
+    except Exception:
+        result = (False, 0)
+    with _status_lock:
+        _status_cache['result'] = result
+        _status_cache['ts'] = time.monotonic()
+    return result
+
+# The rendered page (and its gzipped twin) is only as fresh as the
+# status line anyway, so cache both for the same second
+HOMEPAGE_TTL = 1.0
+_homepage_cache = {'ts': 0.0, 'raw': b'', 'gz': b''}
+_homepage_lock = threading.Lock()
+
+# Shed load instead of piling up stuck generations: at most
+# TC_MAX_CONCURRENCY forwards run at once, each with a hard timeout
+# (TC_GEN_TIMEOUT seconds) instead of hanging forever
+MAX_CONCURRENCY = int(os.environ.get('TC_MAX_CONCURRENCY', '16'))
+GEN_TIMEOUT = float(os.environ.get('TC_GEN_TIMEOUT', '120'))
+_INFLIGHT = threading.Semaphore(MAX_CONCURRENCY)
+
+# The bookmarklet tends to re-ask about the same page, so identical
+# non-streaming request bodies within a few minutes short-circuit to
+# the cached reply and skip the whole LLM invocation. Set TC_CACHE=0
+# to disable. Streaming requests are never cached.
+GEN_CACHE_TTL = 600.0
+GEN_CACHE_MAX = 512
+GEN_CACHE_ENABLED = os.environ.get('TC_CACHE', '1') != '0'
+_gen_cache = OrderedDict()  # key -> (ts, response body bytes)
+_gen_cache_lock = threading.Lock()
+
+def _gen_cache_get(key):
+    """Return the cached body for key, or None if absent/expired"""
+    with _gen_cache_lock:
+        entry = _gen_cache.get(key)
+        if entry is None:
+            return None
+        ts, body = entry
+        if time.monotonic() - ts >= GEN_CACHE_TTL:
+            del _gen_cache[key]
+            return None
+        _gen_cache.move_to_end(key)
+        return body
+
+def _gen_cache_put(key, body):
+    """Store a response body, evicting least-recently-used entries"""
+    with _gen_cache_lock:
+        _gen_cache[key] = (time.monotonic(), body)
+        _gen_cache.move_to_end(key)
+        while len(_gen_cache) > GEN_CACHE_MAX:
+            _gen_cache.popitem(last=False)
+
+# Optional request coalescing: Ollama serializes generate calls, so a
+# burst from many bookmarklet tabs queues up behind one another. With
+# TC_BATCH_WINDOW_MS > 0 we hold same-model prompts for that window and
+# submit one merged numbered prompt, then demux the JSON-array answer.
+# Off by default: a merged prompt changes what the model sees, so
+# answers can differ from one-call-per-prompt.
+BATCH_WINDOW_MS = int(os.environ.get('TC_BATCH_WINDOW_MS', '0'))
+BATCH_MAX = 8
+
+_BATCH_PROMPT = (
+    "Answer each numbered question independently. "
+    "Return ONLY a JSON array of answer strings, one per question.\n"
+)
+
+def _generate(model, prompt):
+    """One non-streaming generate call; returns the response text"""
+    payload = _dumps({"model": model, "prompt": prompt,
+                          "stream": False})
+    response = ollama_request('POST', '/api/generate', body=payload,
+                              headers={'Content-Type': 'application/json'})
+    data = response.read()
+    if response.status != 200:
+        raise RuntimeError(f"Ollama error {response.status}: {response.reason}")
+    return _loads(data).get("response", "")
+
+class _BatchQueue:
+    """Coalesces concurrent same-model prompts into one Ollama call"""
+
+    def __init__(self, window_ms, max_batch=BATCH_MAX):
+        self._window = window_ms / 1000.0
+        self._max = max_batch
+        self._cv = threading.Condition()
+        self._pending = {}
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, model, prompt):
+        """Enqueue a prompt; returns a Future resolving to the answer"""
+        fut = concurrent.futures.Future()
+        with self._cv:
+            self._pending.setdefault(model, []).append((fut, prompt))
+            self._cv.notify()
+        return fut
+
+    def _worker(self):
+        while True:
+            with self._cv:
+                while not self._pending:
+                    self._cv.wait()
+            # A batch has opened - leave the window for stragglers
+            time.sleep(self._window)
+            with self._cv:
+                batches, self._pending = self._pending, {}
+            for model, items in batches.items():
+                while items:
+                    self._flush(model, items[:self._max])
+                    items = items[self._max:]
+
+    def _flush(self, model, items):
+        if len(items) == 1:
+            fut, prompt = items[0]
+            try:
+                fut.set_result(_generate(model, prompt))
+            except Exception as e:
+                fut.set_exception(e)
+            return
+
+        numbered = "\n".join(f"{i + 1}. {prompt}"
+                             for i, (_, prompt) in enumerate(items))
+        try:
+            merged = _generate(model, _BATCH_PROMPT + numbered)
+            answers = _loads(merged)
+            if not isinstance(answers, list) or len(answers) != len(items):
+                raise ValueError("batched answer count mismatch")
+        except Exception:
+            # Model didn't cooperate - fall back to one call per prompt
+            # instead of failing everyone in the batch
+            for fut, prompt in items:
+                try:
+                    fut.set_result(_generate(model, prompt))
+                except Exception as e:
+                    fut.set_exception(e)
+            return
+
+        for (fut, _), answer in zip(items, answers):
+            fut.set_result(str(answer))
+
+_batch_queue = _BatchQueue(BATCH_WINDOW_MS) if BATCH_WINDOW_MS > 0 else None
+
+# CORS headers as pre-formatted lines; only cross-origin requests
+# (those carrying an Origin header) need them, so same-origin dashboard
+# polls skip the three extra header lines entirely
+_CORS_LINES = (
+    "Access-Control-Allow-Origin: *",
+    "Access-Control-Allow-Methods: GET, POST, OPTIONS",
+    "Access-Control-Allow-Headers: Content-Type",
+)
+
+# Preflight responses are identical every time - compose the bytes once
+_OPTIONS_RESPONSE = (
+    "HTTP/1.1 200 OK\r\n"
+    "Content-Length: 0\r\n"
+    "Connection: keep-alive\r\n"
+    + "\r\n".join(_CORS_LINES) + "\r\n\r\n"
+).encode('latin-1')
+
+class TrainingCopilotHandler(http.server.BaseHTTPRequestHandler):
+
+    # HTTP/1.1 keep-alive: browsers reuse the connection across the
+    # dashboard's polls instead of reconnecting. Every response below
+    # must therefore carry Content-Length.
+    protocol_version = "HTTP/1.1"
+
+    # TCP_NODELAY: don't let Nagle hold back the small header and JSON
+    # writes for up to ~40ms on non-loopback links
+    disable_nagle_algorithm = True
+
     def do_OPTIONS(self):
-        self.send_response(200)
-        self.send_CORS_headers()
+        self.wfile.write(_OPTIONS_RESPONSE)
     
     def do_GET(self):
-        if self.path == '/':
-            self.serve_homepage()
-        elif self.path == '/health':
-            self.serve_health_check()
-        elif self.path == '/bookmarklet':
-            self.serve_bookmarklet()
-        elif self.path == '/api/models':
-            self.get_ollama_models()
+        handler = self.GET_ROUTES.get(self.path)
+        if handler:
+            handler(self)
         else:
-            self.send_response(404)
-            self.end_headers()
-    
+            self._write_response(404, b'')
+
     def do_POST(self):
-        if self.path == '/api/generate':
-            self.forward_to_ollama()
+        handler = self.POST_ROUTES.get(self.path)
+        if handler:
+            handler(self)
         else:
-            self.send_response(404)
-            self.end_headers()
-    
+            self._write_response(404, b'')
+
     def send_CORS_headers(self):
+        if not self.headers.get('Origin'):
+            return
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+
+    def _write_response(self, code, body, ctype='application/json',
+                        extra_headers=()):
+        """Send status line, headers, and body in one write.
+
+        send_response/send_header issue a syscall per line; assembling
+        the whole response first cuts that to a single write and always
+        carries Content-Length, which keeps HTTP/1.1 keep-alive intact.
+        """
+        phrase = self.responses.get(code, ('', ''))[0]
+        lines = [
+            f"HTTP/1.1 {code} {phrase}",
+            f"Content-Type: {ctype}",
+            f"Content-Length: {len(body)}",
+            "Connection: keep-alive",
+        ]
+        if self.headers.get('Origin'):
+            lines.extend(_CORS_LINES)
+        lines.extend(extra_headers)
+        head = ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+        self.wfile.write(head + body)
     
     def serve_homepage(self):
         """Serve a simple HTML dashboard"""
-        html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Training Copilot Dashboard</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; margin: 40px; }}
-                .card {{ background: #f5f5f5; padding: 20px; border-radius: 10px; margin: 20px 0; }}
-                .success {{ color: green; }}
-                .error {{ color: red; }}
-                .warning {{ color: orange; }}
-                button {{ padding: 10px 20px; background: #007bff; color: white; border: none; border-radius: 5px; cursor: pointer; }}
-                code {{ background: #eee; padding: 2px 5px; border-radius: 3px; }}
-            </style>
-        </head>
-        <body>
-            <h1>🤖 Training Copilot</h1>
-            
-            <div class="card">
-                <h2>Status</h2>
-                <p>Server: <span class="success">✅ Running</span> on http://localhost:{PORT}</p>
-                <p>Ollama: {self.check_ollama_status()}</p>
-                <p>Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-            </div>
-            
-            <div class="card">
-                <h2>Quick Start</h2>
-                <ol>
-                    <li>Create a bookmark in your browser</li>
-                    <li>Name it: <code>Training Copilot</code></li>
-                    <li>Paste this code as URL:</li>
-                </ol>
-                <textarea id="bookmarkletCode" rows="4" style="width: 100%; font-family: monospace; padding: 10px;">{BOOKMARKLET_CODE}</textarea>
-                <button onclick="copyBookmarklet()">📋 Copy Bookmarklet Code</button>
-            </div>
-            
-            <div class="card">
-                <h2>Testing</h2>
-                <button onclick="testOllama()">Test Ollama Connection</button>
-                <button onclick="testBookmarklet()">Test Bookmarklet</button>
-                <div id="testResult" style="margin-top: 10px;"></div>
-            </div>
-            
-            <script>
-                function copyBookmarklet() {{
-                    const textarea = document.getElementById('bookmarkletCode');
-                    textarea.select();
-                    document.execCommand('copy');
-                    alert('Copied! Create a bookmark with this code.');
-                }}
-                
-                async function testOllama() {{
-                    const resultDiv = document.getElementById('testResult');
-                    resultDiv.innerHTML = 'Testing...';
-                    
-                    try {{
-                        const response = await fetch('/health');
-                        const data = await response.json();
-                        if (data.ollama === 'connected') {{
-                            resultDiv.innerHTML = '<span class="success">✅ Ollama is connected!</span>';
-                        }} else {{
-                            resultDiv.innerHTML = '<span class="warning">⚠️ Ollama not detected. Run: ollama serve</span>';
-                        }}
-                    }} catch (error) {{
-                        resultDiv.innerHTML = '<span class="error">❌ Connection failed</span>';
-                    }}
-                }}
-                
-                function testBookmarklet() {{
-                    // Create a test bookmarklet
-                    const testCode = `javascript:(function(){{alert('Training Copilot Test!\\\\nIf you see this, bookmarklets work.');}})();`;
-                    const link = document.createElement('a');
-                    link.href = testCode;
-                    link.textContent = 'Test Bookmarklet';
-                    link.style.display = 'block';
-                    link.style.margin = '10px 0';
-                    link.style.padding = '10px';
-                    link.style.background = '#28a745';
-                    link.style.color = 'white';
-                    link.style.textDecoration = 'none';
-                    document.body.appendChild(link);
-                }}
-            </script>
-        </body>
-        </html>
-        """
-        
-        self.send_response(200)
-        self.send_header('Content-Type', 'text/html')
-        self.end_headers()
-        self.wfile.write(html.encode('utf-8'))
+        with _homepage_lock:
+            if (time.monotonic() - _homepage_cache['ts'] >= HOMEPAGE_TTL
+                    or not _homepage_cache['raw']):
+                connected, model_count = _probe_ollama()
+                if connected:
+                    status = f"✅ Connected ({model_count} models)".encode('utf-8')
+                else:
+                    status = "❌ Not connected - Run 'ollama serve'".encode('utf-8')
+                now = time.strftime('%Y-%m-%d %H:%M:%S').encode('utf-8')
+                raw = b"".join((_HOMEPAGE_HEAD, status, _HOMEPAGE_MID, now, _HOMEPAGE_TAIL))
+                _homepage_cache['raw'] = raw
+                _homepage_cache['gz'] = gzip.compress(raw, compresslevel=6)
+                _homepage_cache['ts'] = time.monotonic()
+            raw = _homepage_cache['raw']
+            gz = _homepage_cache['gz']
+
+        # Several KB of ASCII gzips to roughly a third of its size -
+        # worth it for any non-loopback client that accepts it
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            self._write_response(200, gz, ctype='text/html',
+                                 extra_headers=('Content-Encoding: gzip',))
+        else:
+            self._write_response(200, raw, ctype='text/html')
     
     def serve_health_check(self):
         """Health check endpoint"""
-        ollama_status = self.check_ollama_status()
-        
+        connected, model_count = _probe_ollama()
+
         health_data = {
             "status": "running",
             "server": "training-copilot",
-            "ollama": "connected" if "✅" in ollama_status else "disconnected",
-            "timestamp": datetime.now().isoformat(),
+            "ollama": "connected" if connected else "disconnected",
+            "model_count": model_count,
+            "timestamp": int(time.time()),
             "port": PORT
         }
         
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.send_CORS_headers()
-        self.end_headers()
-        self.wfile.write(json.dumps(health_data).encode('utf-8'))
+        self._write_response(200, _dumps(health_data))
     
     def serve_bookmarklet(self):
         """Return the bookmarklet code"""
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/javascript')
-        self.send_CORS_headers()
-        self.end_headers()
-        self.wfile.write(BOOKMARKLET_CODE.encode('utf-8'))
+        self._write_response(200, _BOOKMARKLET_BYTES,
+                             ctype='application/javascript')
     
     def get_ollama_models(self):
         """Get available models from Ollama"""
         try:
-            with urllib.request.urlopen(f"{OLLAMA_URL}/api/tags", timeout=2) as response:
-                ollama_data = json.loads(response.read())
-                models = [m.get("name", "") for m in ollama_data.get("models", [])]
-                
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.send_CORS_headers()
-                self.end_headers()
-                self.wfile.write(json.dumps({"models": models}).encode('utf-8'))
+            response = ollama_request('GET', '/api/tags', timeout=2)
+            ollama_data = _loads(response.read())
+            models = [m.get("name", "") for m in ollama_data.get("models", [])]
+            body = _dumps({"models": models})
         except:
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.send_CORS_headers()
-            self.end_headers()
-            self.wfile.write(json.dumps({"models": [], "error": "Ollama not available"}).encode('utf-8'))
+            body = _dumps({"models": [], "error": "Ollama not available"})
+
+        self._write_response(200, body)
     
     def forward_to_ollama(self):
-        """Forward request to Ollama"""
+        """Forward request to Ollama, streaming tokens as they arrive"""
         content_length = int(self.headers['Content-Length'])
         post_data = self.rfile.read(content_length)
-        
+
+        try:
+            request_json = _loads(post_data)
+        except ValueError as e:
+            body = _dumps({
+                "success": False,
+                "error": f"Invalid JSON: {e}"
+            })
+            self._write_response(400, body)
+            return
+
+        # Always stream from Ollama so the first token arrives in
+        # milliseconds instead of after the whole generation finishes;
+        # whether the *client* streams depends on what it asked for
+        client_streams = bool(request_json.get("stream", False))
+
+        # Identical request seen recently? Answer from the cache
+        cache_key = None
+        if GEN_CACHE_ENABLED and not client_streams:
+            cache_key = hashlib.blake2b(post_data, digest_size=16).digest()
+            cached = _gen_cache_get(cache_key)
+            if cached is not None:
+                self._write_response(200, cached)
+                return
+
+        # Coalescing path (TC_BATCH_WINDOW_MS > 0): plain non-streaming
+        # prompts can share one Ollama call with concurrent requests
+        if (_batch_queue is not None and not client_streams
+                and isinstance(request_json.get("prompt"), str)):
+            self.forward_batched(request_json, cache_key)
+            return
+
+        if client_streams:
+            # Body already asks for a stream - forward the raw bytes
+            # instead of re-serializing the parsed dict
+            upstream_body = post_data
+        else:
+            request_json["stream"] = True
+            upstream_body = _dumps(request_json)
+
+        # Too many generations already in flight? Shed this one after a
+        # short wait rather than letting requests pile up unbounded
+        if not _INFLIGHT.acquire(timeout=5):
+            self._write_response(503, _dumps({
+                "success": False,
+                "error": "Server busy - too many generations in flight"
+            }))
+            return
         try:
-            req = urllib.request.Request(
-                f"{OLLAMA_URL}/api/generate",
-                data=post_data,
-                headers={'Content-Type': 'application/json'}
-            )
-            
-            with urllib.request.urlopen(req) as response:
-                ollama_response = json.loads(response.read())
-                
-                # Format response for our bookmarklet
-                result = {
-                    "success": True,
-                    "response": ollama_response.get("response", ""),
-                    "model": json.loads(post_data).get("model", "unknown")
-                }
-                
+            response = ollama_request('POST', '/api/generate', body=upstream_body,
+                                      headers={'Content-Type': 'application/json'},
+                                      timeout=GEN_TIMEOUT)
+
+            if response.status != 200:
+                # Ollama rejected the request (unknown model, bad
+                # options, ...) - surface its error instead of parsing
+                # the error body as an empty token stream
+                err = response.read()
+                try:
+                    message = _loads(err).get("error", response.reason)
+                except Exception:
+                    message = response.reason
+                self._write_response(response.status, _dumps({
+                    "success": False,
+                    "error": f"Ollama error: {message}"
+                }))
+                return
+
+            if client_streams:
+                # Pass Ollama's NDJSON lines straight through as chunks
                 self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Type', 'application/x-ndjson')
                 self.send_CORS_headers()
+                self.send_header('Transfer-Encoding', 'chunked')
                 self.end_headers()
-                self.wfile.write(json.dumps(result).encode('utf-8'))
-                
-        except urllib.error.URLError as e:
-            self.send_response(500)
-            self.send_header('Content-Type', 'application/json')
-            self.send_CORS_headers()
-            self.end_headers()
-            self.wfile.write(json.dumps({
+                while True:
+                    line = response.readline()
+                    if not line:
+                        break
+                    self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+                return
+
+            # Non-streaming client (the bookmarklet): accumulate the
+            # token stream server-side and answer with the old envelope
+            parts = []
+            while True:
+                line = response.readline()
+                if not line:
+                    break
+                chunk = _loads(line)
+                parts.append(chunk.get("response", ""))
+
+            result = {
+                "success": True,
+                "response": "".join(parts),
+                "model": request_json.get("model", "unknown")
+            }
+
+            body = _dumps(result)
+            if cache_key is not None:
+                _gen_cache_put(cache_key, body)
+            self._write_response(200, body)
+
+        except (ConnectionError, OSError) as e:
+            body = _dumps({
                 "success": False,
-                "error": f"Cannot connect to Ollama: {e.reason}"
-            }).encode('utf-8'))
+                "error": f"Cannot connect to Ollama: {e}"
+            })
+            self._write_response(500, body)
         except Exception as e:
-            self.send_response(500)
-            self.send_header('Content-Type', 'application/json')
-            self.send_CORS_headers()
-            self.end_headers()
-            self.wfile.write(json.dumps({
+            body = _dumps({
                 "success": False,
                 "error": f"Internal error: {str(e)}"
-            }).encode('utf-8'))
+            })
+            self._write_response(500, body)
+        finally:
+            _INFLIGHT.release()
     
-    def check_ollama_status(self):
-        """Check if Ollama is running"""
+    def forward_batched(self, request_json, cache_key=None):
+        """Resolve a prompt through the coalescing batch queue"""
+        model = request_json.get("model", "unknown")
         try:
-            with urllib.request.urlopen(f"{OLLAMA_URL}/api/tags", timeout=2) as response:
-                data = json.loads(response.read())
-                model_count = len(data.get("models", []))
-                return f"✅ Connected ({model_count} models)"
-        except:
-            return "❌ Not connected - Run 'ollama serve'"
-    
+            text = _batch_queue.submit(model, request_json["prompt"]).result(timeout=300)
+            code = 200
+            body = _dumps({
+                "success": True,
+                "response": text,
+                "model": model
+            })
+            if cache_key is not None:
+                _gen_cache_put(cache_key, body)
+        except Exception as e:
+            code = 500
+            body = _dumps({
+                "success": False,
+                "error": f"Batched generate failed: {e}"
+            })
+        self._write_response(code, body)
+
     def log_message(self, format, *args):
         print(f"[{datetime.now().strftime('%H:%M:%S')}] {format % args}")
 
-def open_browser():
-    """Open browser to dashboard after a short delay"""
-    time.sleep(1.5)
-    webbrowser.open(f'http://localhost:{PORT}')
+    # Route tables - one dict lookup per request instead of if/elif chains
+    GET_ROUTES = {
+        '/': serve_homepage,
+        '/health': serve_health_check,
+        '/bookmarklet': serve_bookmarklet,
+        '/api/models': get_ollama_models,
+    }
+    POST_ROUTES = {
+        '/api/generate': forward_to_ollama,
+    }
+
+# Ollama unloads idle models, and the first generate afterwards pays a
+# multi-second reload. A background loop nudges the default model every
+# few minutes so user requests always land on a warm model.
+DEFAULT_MODEL = os.environ.get('TC_DEFAULT_MODEL', '')
+WARM_INTERVAL = 240.0
+
+def _warm_loop():
+    """Keep the default model loaded with a periodic empty generate"""
+    global DEFAULT_MODEL
+    while True:
+        try:
+            model = DEFAULT_MODEL
+            if not model:
+                # No model configured - warm whatever Ollama lists first
+                response = ollama_request('GET', '/api/tags', timeout=2)
+                models = _loads(response.read()).get("models", [])
+                if models:
+                    model = models[0].get("name", "")
+                    DEFAULT_MODEL = model
+            if model:
+                payload = _dumps({"model": model, "prompt": "",
+                                  "keep_alive": "10m"})
+                response = ollama_request('POST', '/api/generate', body=payload,
+                                          headers={'Content-Type': 'application/json'})
+                response.read()
+        except Exception:
+            # Ollama not reachable - try again next cycle
+            pass
+        time.sleep(WARM_INTERVAL)
+
+class TrainingCopilotServer(http.server.ThreadingHTTPServer):
+    """ThreadingHTTPServer with a deep accept queue and, where the
+    platform has it, SO_REUSEPORT so worker processes share the port"""
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def server_bind(self):
+        if hasattr(socket, 'SO_REUSEPORT'):
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
 
 def main():
     print(f"""
@@ -291,15 +624,39 @@ def main():
     Press Ctrl+C to stop
     """)
     
-    # Open browser automatically
-    threading.Thread(target=open_browser, daemon=True).start()
+    # TC_WORKERS > 1: fork extra workers, each binding its own
+    # SO_REUSEPORT socket so the kernel spreads connections across
+    # processes (and past the GIL)
+    workers = WORKERS
+    if workers > 1 and not (hasattr(socket, 'SO_REUSEPORT') and hasattr(os, 'fork')):
+        print("⚠️  TC_WORKERS needs SO_REUSEPORT and fork; running one process")
+        workers = 1
+    is_parent = True
+    for _ in range(workers - 1):
+        if os.fork() == 0:
+            is_parent = False
+            break
+
+    if is_parent:
+        # Keep the model warm so the first query after a pause isn't slow
+        # (one loop total, not one per worker)
+        threading.Thread(target=_warm_loop, daemon=True).start()
     
     try:
-        with socketserver.TCPServer(("", PORT), TrainingCopilotHandler) as httpd:
-            print(f"✅ Server started successfully!")
-            print(f"🌐 Dashboard: http://localhost:{PORT}")
-            print(f"🤖 AI Endpoint: http://localhost:{PORT}/api/generate")
-            print(f"\n📖 Open your browser to the dashboard for instructions.")
+        # Each request gets its own thread, so a long Ollama generation
+        # doesn't block /health or the dashboard
+        with TrainingCopilotServer(("", PORT), TrainingCopilotHandler) as httpd:
+            if is_parent:
+                print(f"✅ Server started successfully!")
+                print(f"🌐 Dashboard: http://localhost:{PORT}")
+                print(f"🤖 AI Endpoint: http://localhost:{PORT}/api/generate")
+                if workers > 1:
+                    print(f"👥 Worker processes: {workers}")
+                print(f"\n📖 Open your browser to the dashboard for instructions.")
+                # The listening socket already queues connections, so
+                # the browser can be opened inline - no thread that
+                # exists just to wait for the server
+                webbrowser.open(f'http://localhost:{PORT}')
             httpd.serve_forever()
     except KeyboardInterrupt:
         print("\n\n👋 Server stopped")